@@ -1,68 +1,225 @@
 import streamlit as st
 import pandas as pd
 from io import BytesIO
-from datetime import datetime
 import matplotlib.pyplot as plt
 
 
 # Function to perform RFM Analysis
 import pandas as pd
 import numpy as np
-from datetime import datetime
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; large uploads fall back to the pandas groupby
+    njit = None
+
+# Columns expected in the uploaded workbook
+REQUIRED_COLUMNS = ['Branch', 'Route', 'Customer', 'Date of Purchase']
+
+# Customer segment for each RFM_Score_int (100*R + 10*F + M)
+_SEGMENT_LUT = np.full(445, 'Other', dtype=object)
+_SEGMENT_LUT[144] = 'Best Customers'
+_SEGMENT_LUT[143] = 'Loyal Customers'
+_SEGMENT_LUT[133] = 'Potential Loyalists'
+_SEGMENT_LUT[122] = 'Recent Customers'
+_SEGMENT_LUT[111] = 'Lost Customers'
+_SEGMENT_LUT[222] = 'At Risk'
+_SEGMENT_LUT[333] = 'Churned'
+_SEGMENT_LUT[444] = 'New Customers'
+
+
+# Quartile score (1-4) for the valid values, 0 elsewhere; bins are right-closed like pd.qcut
+def _score(a, valid, reverse=False):
+    s = np.zeros(len(a), dtype=np.int8)
+    if valid.any():
+        edges = np.quantile(a[valid], [.25, .5, .75])
+        s[valid] = np.searchsorted(edges, a[valid], side='left') + 1
+        if reverse:
+            s[valid] = 5 - s[valid]
+    return s
+
+
+# Uploads above this many rows use the numba kernel when it is available
+NUMBA_MIN_ROWS = 500_000
+
+if njit is not None:
+    # One pass over the rows, indexed by customer code: first row, last purchase day,
+    # row count and first non-null Branch/Route code per customer
+    @njit(cache=True)
+    def _reduce_groups(codes, dates, branch_codes, route_codes, n_groups):
+        first_row = np.full(n_groups, -1, np.int64)
+        last = np.full(n_groups, np.iinfo(np.int64).min, np.int64)  # NaT
+        size = np.zeros(n_groups, np.int32)
+        branch = np.full(n_groups, -1, np.int64)
+        route = np.full(n_groups, -1, np.int64)
+        for i in range(len(codes)):
+            g = codes[i]
+            if g < 0:
+                continue
+            if first_row[g] < 0:
+                first_row[g] = i
+            size[g] += 1
+            if dates[i] > last[g]:
+                last[g] = dates[i]
+            if branch[g] < 0:
+                branch[g] = branch_codes[i]
+            if route[g] < 0:
+                route[g] = route_codes[i]
+        return first_row, last, size, branch, route
+else:
+    _reduce_groups = None
+
+
+# Same result as the pandas groupby in perform_rfm_analysis (values, index and order), via _reduce_groups
+def _aggregate_numba(data):
+    customers = data['Customer'].astype('category')
+    branches = data['Branch'].astype('category')
+    routes = data['Route'].astype('category')
+    # intp codes keep a single compiled signature whatever the category count
+    first_row, last, size, branch, route = _reduce_groups(
+        customers.cat.codes.values.astype(np.intp),
+        data['Date of Purchase'].values.astype('datetime64[D]').view(np.int64),
+        branches.cat.codes.values.astype(np.intp),
+        routes.cat.codes.values.astype(np.intp),
+        len(customers.cat.categories)
+    )
+    # Observed customers in order of first appearance, like groupby(sort=False)
+    groups = np.flatnonzero(first_row >= 0)
+    groups = groups[np.argsort(first_row[groups])]
+    return pd.DataFrame(
+        {
+            'LastDate': last[groups].view('datetime64[D]'),
+            'Frequency': size[groups],
+            'Monetary': size[groups],
+            'Branch': pd.Categorical.from_codes(branch[groups], branches.cat.categories),
+            'Route': pd.Categorical.from_codes(route[groups], routes.cat.categories)
+        },
+        index=pd.CategoricalIndex(
+            pd.Categorical.from_codes(groups, customers.cat.categories), name='Customer'
+        )
+    )
+
 
 # Function to perform RFM Analysis
 def perform_rfm_analysis(data):
     # Ensure the columns are correctly named
-    required_columns = ['Branch', 'Route', 'Customer', 'Date of Purchase']
-    if not all(col in data.columns for col in required_columns):
-        raise ValueError(f"Missing required columns: {', '.join(required_columns)}")
+    missing = [col for col in REQUIRED_COLUMNS if col not in data.columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
 
-    # Convert 'Date of Purchase' to datetime
-    data['Date of Purchase'] = pd.to_datetime(data['Date of Purchase'])
+    # Convert 'Date of Purchase' to datetime unless the loader already did
+    if not pd.api.types.is_datetime64_any_dtype(data['Date of Purchase']):
+        data['Date of Purchase'] = pd.to_datetime(data['Date of Purchase'])
 
     # Calculate Recency, Frequency, and Monetary values
-    now = datetime.now()
-    rfm = data.groupby('Customer').agg({
-        'Date of Purchase': lambda x: (now - x.max()).days,  # Recency
-        'Route': 'count',  # Frequency
-        'Branch': 'count'  # Monetary proxy (replace with actual value if available)
-    })
-    rfm.columns = ['Recency', 'Frequency', 'Monetary']
+    if _reduce_groups is not None and len(data) > NUMBA_MIN_ROWS:
+        rfm = _aggregate_numba(data)
+    else:
+        rfm = data.groupby('Customer', sort=False, observed=True).agg(
+            LastDate=('Date of Purchase', 'max'),
+            Frequency=('Route', 'size'),
+            Monetary=('Branch', 'size'),  # Monetary proxy (replace with actual value if available)
+            Branch=('Branch', 'first'),
+            Route=('Route', 'first')
+        )
+    return _score_rfm(rfm)
 
-    # Assign RFM scores
-    rfm['R_Score'] = pd.qcut(rfm['Recency'], 4, labels=[4, 3, 2, 1])  # Lower recency = higher score
-    rfm['F_Score'] = pd.qcut(rfm['Frequency'], 4, labels=[1, 2, 3, 4])  # Higher frequency = higher score
-    rfm['M_Score'] = pd.qcut(rfm['Monetary'], 4, labels=[1, 2, 3, 4])  # Higher monetary = higher score
-    rfm['RFM_Score'] = rfm['R_Score'].astype(str) + rfm['F_Score'].astype(str) + rfm['M_Score'].astype(str)
-
-    # Define customer segmentation
-    rfm['Segment'] = np.select(
-        [
-            (rfm['R_Score'] == '1') & (rfm['F_Score'] == '4') & (rfm['M_Score'] == '4'),
-            (rfm['R_Score'] == '1') & (rfm['F_Score'] == '4') & (rfm['M_Score'] == '3'),
-            (rfm['R_Score'] == '1') & (rfm['F_Score'] == '3') & (rfm['M_Score'] == '3'),
-            (rfm['R_Score'] == '1') & (rfm['F_Score'] == '2') & (rfm['M_Score'] == '2'),
-            (rfm['R_Score'] == '1') & (rfm['F_Score'] == '1') & (rfm['M_Score'] == '1'),
-            (rfm['R_Score'] == '2') & (rfm['F_Score'] == '2') & (rfm['M_Score'] == '2'),
-            (rfm['R_Score'] == '3') & (rfm['F_Score'] == '3') & (rfm['M_Score'] == '3'),
-            (rfm['R_Score'] == '4') & (rfm['F_Score'] == '4') & (rfm['M_Score'] == '4')
-        ],
-        [
-            'Best Customers',
-            'Loyal Customers',
-            'Potential Loyalists',
-            'Recent Customers',
-            'Lost Customers',
-            'At Risk',
-            'Churned',
-            'New Customers'
-        ],
-        default='Other'
+
+# Recency and R/F/M scores from per-customer LastDate, Frequency, Monetary, Branch, Route
+def _score_rfm(rfm):
+    # Customers without any purchase date keep NA Recency, R_Score and RFM_Score_int
+    last_date = rfm['LastDate'].values.astype('datetime64[D]')
+    valid = ~np.isnat(last_date)
+    recency = np.zeros(len(rfm), dtype=np.int32)
+    recency[valid] = (np.datetime64('today', 'D') - last_date[valid]).astype(np.int32)
+    rfm['Recency'] = pd.arrays.IntegerArray(recency, ~valid)
+    rfm = rfm[['Recency', 'Frequency', 'Monetary', 'Branch', 'Route']].astype(
+        {'Frequency': 'int32', 'Monetary': 'int32'}
     )
 
+    # Assign RFM scores
+    r = _score(recency, valid, reverse=True)  # Lower recency = higher score
+    all_rows = np.ones(len(rfm), dtype=bool)
+    f = _score(rfm['Frequency'].values, all_rows)  # Higher frequency = higher score
+    m = _score(rfm['Monetary'].values, all_rows)  # Higher monetary = higher score
+    rfm['R_Score'] = pd.arrays.IntegerArray(r, ~valid)
+    rfm['F_Score'] = f
+    rfm['M_Score'] = m
+    score = r.astype(np.int16) * 100 + f.astype(np.int16) * 10 + m.astype(np.int16)
+    rfm['RFM_Score_int'] = pd.arrays.IntegerArray(score, ~valid)
+
+    # Define customer segmentation; rows without R_Score map to slot 0, which is 'Other'
+    rfm['Segment'] = _SEGMENT_LUT[np.where(valid, score, 0)]
+
     return rfm
 
 
+# Cached helpers, keyed on the uploaded file's bytes so widget reruns skip the work
+@st.cache_data
+def load_excel(file_bytes):
+    data = pd.read_excel(
+        BytesIO(file_bytes),
+        engine='calamine',
+        usecols=lambda col: col in REQUIRED_COLUMNS,
+        dtype={'Branch': 'category', 'Route': 'category', 'Customer': 'category'}
+    )
+    # Parse dates once here; parse_dates= would fail before the missing-column check
+    if 'Date of Purchase' in data.columns:
+        data['Date of Purchase'] = pd.to_datetime(data['Date of Purchase'])
+    return data
+
+
+@st.cache_data
+def cached_rfm(file_bytes):
+    return perform_rfm_analysis(load_excel(file_bytes))
+
+
+# Fast mode: read and aggregate with polars, then score the per-customer frame in pandas
+@st.cache_data
+def cached_rfm_polars(file_bytes):
+    import polars as pl
+
+    # Check the header first so a missing column gets the same error as the pandas path
+    header = pl.read_excel(BytesIO(file_bytes), engine='calamine', read_options={'n_rows': 0})
+    missing = [col for col in REQUIRED_COLUMNS if col not in header.columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+    raw = pl.read_excel(BytesIO(file_bytes), engine='calamine', columns=REQUIRED_COLUMNS)
+    if raw.schema['Date of Purchase'] == pl.Utf8:
+        raw = raw.with_columns(pl.col('Date of Purchase').str.to_datetime())
+
+    rfm = raw.drop_nulls('Customer').group_by('Customer', maintain_order=True).agg(
+        pl.col('Date of Purchase').max().cast(pl.Datetime).alias('LastDate'),
+        pl.len().alias('Frequency'),
+        pl.len().alias('Monetary'),
+        pl.col('Branch').drop_nulls().first(),
+        pl.col('Route').drop_nulls().first()
+    )
+    return _score_rfm(rfm.to_pandas().set_index('Customer'))
+
+
+@st.cache_data
+def segmentation_chart_png(keys, counts):
+    order = np.argsort(-counts, kind='stable')
+    fig, ax = plt.subplots()
+    ax.bar(keys[order].astype(str), counts[order])
+    ax.set_title("RFM Segmentation")
+    ax.set_xlabel("RFM Score")
+    ax.set_ylabel("Count")
+    buf = BytesIO()
+    fig.savefig(buf, format='png')
+    plt.close(fig)
+    return buf.getvalue()
+
+
+@st.cache_data
+def to_excel_bytes(df, sheet_name, index=True):
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=index, sheet_name=sheet_name)
+    return output.getvalue()
+
+
 # Streamlit UI
 st.title("Analysis Tool")
 st.write("Upload your dataset and select the analysis you want to perform.")
@@ -70,6 +227,7 @@ st.write("Upload your dataset and select the analysis you want to perform.")
 # Sidebar with buttons for analysis
 st.sidebar.title("Select Analysis")
 analysis_option = st.sidebar.radio("Choose an analysis to perform", ["None", "RFM Analysis"])
+use_polars = st.sidebar.checkbox("Fast mode (large files)")
 
 # File uploader
 uploaded_file = st.file_uploader("Upload an Excel file", type=["xlsx"])
@@ -77,12 +235,12 @@ uploaded_file = st.file_uploader("Upload an Excel file", type=["xlsx"])
 if uploaded_file:
     try:
         # Read the uploaded file
-        data = pd.read_excel(uploaded_file)
+        file_bytes = uploaded_file.getvalue()
 
         # Perform RFM Analysis if the button is clicked
         if analysis_option == "RFM Analysis":
             # Perform RFM Analysis
-            rfm_result = perform_rfm_analysis(data)
+            rfm_result = cached_rfm_polars(file_bytes) if use_polars else cached_rfm(file_bytes)
 
             # Display the results
             st.subheader("RFM Analysis Results")
@@ -90,20 +248,13 @@ if uploaded_file:
 
             # Visualization
             st.subheader("RFM Segmentation Distribution")
-            fig, ax = plt.subplots()
-            rfm_result['RFM_Score'].value_counts().plot(kind='bar', ax=ax)
-            ax.set_title("RFM Segmentation")
-            ax.set_xlabel("RFM Score")
-            ax.set_ylabel("Count")
-            st.pyplot(fig)
+            keys, counts = np.unique(rfm_result['RFM_Score_int'].dropna().to_numpy(dtype=np.int16), return_counts=True)
+            st.image(segmentation_chart_png(keys, counts))
 
             # Download button for results
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                rfm_result.to_excel(writer, index=True, sheet_name='RFM Results')
             st.download_button(
                 label="Download RFM Results as Excel",
-                data=output.getvalue(),
+                data=to_excel_bytes(rfm_result, 'RFM Results'),
                 file_name="rfm_results.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
@@ -121,12 +272,9 @@ if st.button("Download Excel Template"):
         'Customer': ['Cust1', 'Cust2', 'Cust3'],
         'Date of Purchase': ['2023-01-01', '2023-02-15', '2023-03-10']
     })
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        template_data.to_excel(writer, index=False, sheet_name='Template')
     st.download_button(
         label="Download Excel Template",
-        data=output.getvalue(),
+        data=to_excel_bytes(template_data, 'Template', index=False),
         file_name="rfm_template.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )